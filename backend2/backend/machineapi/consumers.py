@@ -2,14 +2,42 @@
 WebSocket Consumer for Real-time Video Analysis
 Handles video frame streaming from Flutter app and returns AI analysis
 """
-import json
 import asyncio
-import base64
+import orjson
+import pybase64
+import cv2
+import numpy as np
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .openai_service import get_openai_video_analysis_service
 
 
+def _dhash(frame_data: bytes):
+    """64-bit difference hash of a frame, or None if it cannot be decoded
+
+    Decodes at 1/8 scale, shrinks to a 9x8 grayscale thumbnail and hashes
+    the sign of each horizontal gradient - enough to tell whether two
+    frames are visually the same scene.
+    """
+    arr = np.frombuffer(frame_data, np.uint8)
+    gray = cv2.imdecode(arr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(diff).tobytes(), 'big')
+
+
+def _decode_frame(text_data: str) -> bytes:
+    """Decode a "data:image/...;base64,..." text frame to raw image bytes"""
+    _, sep, payload = text_data.partition(',')
+    if not sep:
+        raise ValueError("Malformed data URL: missing base64 payload")
+    # validate=True rejects stray characters inside the SIMD decode path
+    # instead of falling back to a Python-level re-scan
+    return pybase64.b64decode(payload, validate=True)
+
+
 class VideoAnalysisConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for real-time video drowsiness analysis
@@ -24,7 +52,25 @@ class VideoAnalysisConsumer(AsyncWebsocketConsumer):
         self.frame_count = 0
         self.analysis_interval = 1  # Analyze every Nth frame
         self.last_analysis_result = None
+        self.max_batch_size = 8
+        # Skip the LLM when a frame is perceptually identical to the last
+        # analyzed one (Hamming distance on the 64-bit dHash)
+        self.dedup_threshold = 2
+        self._last_hash = None
+        # Bounded queue: when full, the oldest frame is dropped so the
+        # analysis always tracks the newest video instead of a backlog
+        self.queue = asyncio.Queue(maxsize=self.max_batch_size)
+        self._worker = None
     
+    async def _send_json(self, obj):
+        """Send a JSON message as a binary frame
+
+        orjson already produces bytes; sending them via bytes_data skips
+        the str allocation and UTF-8 re-encode that text_data would cost.
+        The payload on the wire is identical UTF-8 JSON.
+        """
+        await self.send(bytes_data=orjson.dumps(obj))
+
     async def connect(self):
         """Handle WebSocket connection"""
         self.group_name = "video_analysis"
@@ -35,104 +81,243 @@ class VideoAnalysisConsumer(AsyncWebsocketConsumer):
         # Initialize the OpenAI GPT analysis service
         try:
             self.analysis_service = get_openai_video_analysis_service()
-            await self.send(text_data=json.dumps({
+            self._worker = asyncio.create_task(self._consume())
+            await self._send_json({
                 "type": "connection_established",
                 "message": "Connected to video analysis service",
                 "status": "ready"
-            }))
+            })
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self._send_json({
                 "type": "connection_error",
                 "message": f"Failed to initialize analysis service: {str(e)}",
                 "status": "error"
-            }))
+            })
             await self.close()
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
         print(f"WebSocket disconnected with code: {close_code}")
-        # Clean up if needed
+        # Stop the worker; any frames still queued are discarded with it
+        if self._worker is not None:
+            self._worker.cancel()
     
     async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming video frames from Flutter app"""
         try:
+            if text_data:
+                if text_data.startswith("data:image/"):
+                    # Frame sent as a text data URL - decode it and fall
+                    # through to the binary frame path below
+                    bytes_data = _decode_frame(text_data)
+                    text_data = None
+
             if text_data:
                 # Text message - could be configuration or control messages
-                data = json.loads(text_data)
-                
+                data = orjson.loads(text_data)
+
                 if data.get("type") == "configure":
                     # Configure analysis parameters
                     self.analysis_interval = data.get("interval", 1)
-                    await self.send(text_data=json.dumps({
+                    await self._send_json({
                         "type": "configuration_acknowledged",
                         "interval": self.analysis_interval
-                    }))
+                    })
                     return
             
             if bytes_data:
                 # Binary data - video frame
                 self.frame_count += 1
-                
+
                 # Only analyze every Nth frame to reduce load
                 if self.frame_count % self.analysis_interval == 0:
-                    await self.process_frame(bytes_data)
+                    frame_hash = _dhash(bytes_data)
+                    if (frame_hash is not None
+                            and self._last_hash is not None
+                            and self.last_analysis_result is not None
+                            and (frame_hash ^ self._last_hash).bit_count()
+                            <= self.dedup_threshold):
+                        # Scene has not changed - reuse the last analysis
+                        # instead of paying for another LLM round-trip
+                        await self._send_json({
+                            "type": "analysis_result",
+                            "frame_number": self.frame_count,
+                            "cached": True,
+                            "data": self.last_analysis_result
+                        })
+                    else:
+                        # The hash travels with the frame; it only becomes
+                        # the dedup reference once analysis succeeds
+                        await self._enqueue_frame(
+                            self.frame_count, bytes_data, frame_hash
+                        )
                 else:
                     # Send acknowledgment for skipped frames
-                    await self.send(text_data=json.dumps({
+                    await self._send_json({
                         "type": "frame_received",
                         "frame_number": self.frame_count,
                         "analyzed": False
-                    }))
+                    })
                     
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except orjson.JSONDecodeError:
+            await self._send_json({
                 "type": "error",
                 "message": "Invalid JSON format"
-            }))
+            })
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self._send_json({
                 "type": "error",
                 "message": str(e)
-            }))
+            })
     
-    async def process_frame(self, frame_data: bytes):
-        """Process video frame with OpenAI GPT-4o"""
+    async def _enqueue_frame(self, frame_number: int, frame_data: bytes,
+                             frame_hash=None):
+        """Queue a frame for analysis, dropping the oldest if we are behind"""
+        try:
+            self.queue.put_nowait((frame_number, frame_data, frame_hash))
+        except asyncio.QueueFull:
+            try:
+                dropped_number, _, _ = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                dropped_number = None
+            self.queue.put_nowait((frame_number, frame_data, frame_hash))
+            await self._send_json({
+                "type": "frame_dropped",
+                "frame_number": dropped_number
+            })
+
+    async def _consume(self):
+        """Worker loop: pull queued frames and dispatch them in batches"""
+        while True:
+            # Block for the first frame, then drain whatever arrived while
+            # the previous batch was in flight - natural micro-batching
+            pending = [await self.queue.get()]
+            while len(pending) < self.max_batch_size:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._dispatch_batch(pending)
+            except Exception as e:
+                # The dispatch error handlers themselves send over the
+                # socket, which can raise mid-disconnect; one bad send must
+                # not kill the worker and stop all later frame processing
+                print(f"Frame dispatch failed: {e}")
+
+    async def _dispatch_batch(self, pending: list):
+        """Dispatch a batch of coalesced frames to the LLM in a single gather"""
+        if len(pending) == 1:
+            await self.process_frame(*pending[0])
+            return
+
+        try:
+            if not self.analysis_service:
+                await self._send_json({
+                    "type": "error",
+                    "message": "Analysis service not initialized"
+                })
+                return
+
+            await self._send_json({
+                "type": "processing",
+                "frame_numbers": [number for number, _, _ in pending],
+                "message": "Analyzing frames..."
+            })
+
+            results = await self.analysis_service.analyze_frame_batch(
+                [frame for _, frame, _ in pending]
+            )
+
+            # One gather, but per-frame envelopes in arrival order - the
+            # client only understands analysis_result messages
+            for (number, _, frame_hash), result in zip(pending, results):
+                self._cache_result(result, frame_hash)
+                await self._send_json({
+                    "type": "analysis_result",
+                    "frame_number": number,
+                    "data": result
+                })
+
+        except Exception as e:
+            await self._send_json({
+                "type": "analysis_error",
+                "frame_number": pending[-1][0],
+                "error": str(e)
+            })
+
+    def _cache_result(self, result: dict, frame_hash):
+        """Remember a result for dedup replay, but only if analysis worked
+
+        Error payloads must never be replayed as a cached verdict, and the
+        dedup hash only advances alongside a result it actually describes.
+        """
+        if "error" in result:
+            return
+        self.last_analysis_result = result
+        if frame_hash is not None:
+            self._last_hash = frame_hash
+
+    async def process_frame(self, frame_number: int, frame_data: bytes,
+                            frame_hash=None):
+        """Process a single video frame with OpenAI GPT-4o"""
         try:
             # Send processing status
-            await self.send(text_data=json.dumps({
+            await self._send_json({
                 "type": "processing",
-                "frame_number": self.frame_count,
+                "frame_number": frame_number,
                 "message": "Analyzing frame..."
-            }))
-            
+            })
+
             # Analyze frame using OpenAI GPT-4o
             if self.analysis_service:
-                result = await self.analysis_service.analyze_frame(frame_data)
-                self.last_analysis_result = result
-                
-                # Send analysis result back to client
-                await self.send(text_data=json.dumps({
-                    "type": "analysis_result",
-                    "frame_number": self.frame_count,
-                    "data": result
-                }))
+                async def on_delta(delta):
+                    # Forward streamed tokens so the client can show
+                    # progress before the full analysis lands
+                    await self._send_json({
+                        "type": "token",
+                        "frame_number": frame_number,
+                        "delta": delta
+                    })
+
+                result, raw = await self.analysis_service.analyze_frame(
+                    frame_data, return_raw=True, on_delta=on_delta
+                )
+                self._cache_result(result, frame_hash)
+
+                # Send analysis result back to client; when the model's JSON
+                # parsed cleanly, splice it into the envelope as-is instead
+                # of re-serializing the dict we just parsed
+                if raw is not None:
+                    envelope = (
+                        b'{"type":"analysis_result","frame_number":'
+                        + str(frame_number).encode()
+                        + b',"data":' + raw.encode() + b'}'
+                    )
+                    await self.send(bytes_data=envelope)
+                else:
+                    await self._send_json({
+                        "type": "analysis_result",
+                        "frame_number": frame_number,
+                        "data": result
+                    })
             else:
-                await self.send(text_data=json.dumps({
+                await self._send_json({
                     "type": "error",
                     "message": "Analysis service not initialized"
-                }))
-                
+                })
+
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self._send_json({
                 "type": "analysis_error",
-                "frame_number": self.frame_count,
+                "frame_number": frame_number,
                 "error": str(e)
-            }))
+            })
     
     async def send_analysis_result(self, result: dict):
         """Send analysis result to WebSocket client"""
-        await self.send(text_data=json.dumps({
+        await self._send_json({
             "type": "analysis_result",
             "data": result
-        }))
+        })
 
@@ -11,15 +11,28 @@ For Groq, we'll use their fastest model for text-based analysis.
 For actual image analysis, consider switching to OpenAI's GPT-4o.
 """
 import os
-import base64
-import json
+import pybase64
+import orjson
 import asyncio
+import functools
+import httpx
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from groq import Groq
+from groq import AsyncGroq
 from PIL import Image
 import io
 
 
+# Shared pool for CPU-bound image work so it never blocks the event loop
+_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Precompiled big-endian u32 reader - cheaper than int.from_bytes on a
+# sliced copy, and this runs once per frame
+_U32BE = struct.Struct('>I').unpack_from
+
+
 class GroqVideoAnalysisService:
     """Service for analyzing video frames using Groq API"""
     
@@ -28,13 +41,25 @@ class GroqVideoAnalysisService:
         if not self.api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables")
         
-        self.client = Groq(api_key=self.api_key)
+        # Async client with a pooled HTTP/2 transport - the connection pool
+        # is shared by every consumer through the service singleton, so
+        # frames reuse warm TLS connections instead of handshaking per call
+        self.client = AsyncGroq(
+            api_key=self.api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
         
         # Groq's available models (as of 2024)
         # For fastest inference, use llama-3.1-8b-instant
         # For better reasoning, use llama-3.1-70b-versatile
         # Note: Groq doesn't have native vision models yet
         self.model = "llama-3.1-70b-versatile"
+
+        # Per-thread scratch state (JPEG buffers) for executor workers
+        self._local = threading.local()
         
         # Analysis prompt for text-based analysis
         # In production, you would use OpenAI GPT-4o for actual image analysis
@@ -57,35 +82,65 @@ class GroqVideoAnalysisService:
             "recommended_action": "action to take"
         }
         """
-    
+
+        # Static system message, built once - only the user content
+        # changes between frames
+        self._system_msg = {
+            "role": "system",
+            "content": "You are a driver drowsiness detection system. Analyze monitoring data and respond only with valid JSON."
+        }
+
+    def _get_jpeg_buffer(self) -> io.BytesIO:
+        """Reusable per-thread JPEG buffer (encode runs on executor threads)"""
+        buffer = getattr(self._local, 'jpeg_buf', None)
+        if buffer is None:
+            buffer = self._local.jpeg_buf = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        return buffer
+
     def encode_image(self, image: Image.Image) -> str:
         """Encode PIL image to base64 string"""
-        buffer = io.BytesIO()
+        buffer = self._get_jpeg_buffer()
         image.save(buffer, format='JPEG', quality=70)
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # getbuffer() avoids copying the JPEG bytes before the SIMD encode
+        return pybase64.b64encode(buffer.getbuffer()).decode('ascii')
     
-    async def analyze_frame(self, frame_data: bytes) -> dict:
-        """Analyze a single video frame"""
+    @staticmethod
+    def _inspect_frame(frame_data: bytes) -> tuple:
+        """Decode frame metadata (runs in the executor)"""
+        image = Image.open(io.BytesIO(frame_data))
+        return image.size[0], image.size[1], image.mode
+
+    async def analyze_frame(self, frame_data: bytes, return_raw: bool = False,
+                            on_delta=None):
+        """Analyze a single video frame
+
+        With return_raw=True, returns (result, raw_json) where raw_json is
+        the model's own JSON text when it parsed cleanly (None otherwise),
+        so callers can splice it into an envelope without re-serializing.
+
+        on_delta is accepted for interface parity with the OpenAI service
+        so the consumer can treat the two as interchangeable; this service
+        does not stream, so the callback is never invoked.
+        """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(frame_data))
-            
-            # Get image dimensions and basic info
-            width, height = image.size
-            mode = image.mode
-            
+            loop = asyncio.get_running_loop()
+
+            # Decode image info off the event loop
+            width, height, mode = await loop.run_in_executor(
+                _EXECUTOR, self._inspect_frame, frame_data
+            )
+
             # Create a simplified analysis based on image properties
             # Note: This is a placeholder. For actual vision analysis,
             # use OpenAI's GPT-4o instead.
-            
+
             # Prepare analysis request
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a driver drowsiness detection system. Analyze monitoring data and respond only with valid JSON."
-                    },
+                    self._system_msg,
                     {
                         "role": "user",
                         "content": f"""Analyze this driver monitoring frame:
@@ -96,13 +151,13 @@ class GroqVideoAnalysisService:
                         Assume the driver is being monitored in good conditions.
                         
                         Respond ONLY with valid JSON, no markdown formatting.
-                        Current frame: Frame number {int.from_bytes(frame_data[:4], 'big') if len(frame_data) >= 4 else 0}"""
+                        Current frame: Frame number {_U32BE(frame_data)[0] if len(frame_data) >= 4 else 0}"""
                     }
                 ],
                 max_tokens=500,
                 temperature=0.3
             )
-            
+
             # Parse JSON response
             content = response.choices[0].message.content.strip()
             
@@ -113,14 +168,17 @@ class GroqVideoAnalysisService:
                 content = content[3:-3]
             
             # Try to parse JSON
+            raw = None
             try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
+                result = orjson.loads(content)
+                raw = content
+            except orjson.JSONDecodeError:
                 # If not valid JSON, try to extract JSON from text
                 start = content.find('{')
                 end = content.rfind('}') + 1
                 if start != -1 and end != 0:
-                    result = json.loads(content[start:end])
+                    raw = content[start:end]
+                    result = orjson.loads(raw)
                 else:
                     result = {
                         "drowsiness_level": "awake",
@@ -128,33 +186,28 @@ class GroqVideoAnalysisService:
                         "observations": ["Frame captured successfully"],
                         "recommended_action": "Continue monitoring"
                     }
-            
-            return result
-            
+
+            return (result, raw) if return_raw else result
+
         except Exception as e:
-            return {
+            result = {
                 "error": str(e),
                 "drowsiness_level": "unknown",
                 "confidence": 0.0,
                 "observations": ["Failed to analyze frame"],
                 "recommended_action": "Check system connection"
             }
+            return (result, None) if return_raw else result
     
     async def analyze_frame_sync(self, frame_data: bytes) -> dict:
         """Synchronous wrapper for frame analysis"""
         return await self.analyze_frame(frame_data)
 
 
-# Singleton instance
-_video_analysis_service: Optional[GroqVideoAnalysisService] = None
-
-
+@functools.cache
 def get_video_analysis_service() -> GroqVideoAnalysisService:
     """Get or create the video analysis service singleton"""
-    global _video_analysis_service
-    if _video_analysis_service is None:
-        _video_analysis_service = GroqVideoAnalysisService()
-    return _video_analysis_service
+    return GroqVideoAnalysisService()
 
 
 async def process_frame_batch(frames: list) -> list:
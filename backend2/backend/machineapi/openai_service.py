@@ -6,28 +6,70 @@ This service provides true vision capabilities for drowsiness detection
 by analyzing actual video frames with GPT-4o's multimodal model.
 """
 import os
-import base64
-import json
+import pybase64
+import orjson
 import asyncio
+import functools
+import httpx
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from openai import OpenAI
+from openai import AsyncOpenAI
 from PIL import Image
+from turbojpeg import TurboJPEG, TJPF_RGB
+import cv2
 import io
 
 
+# Shared pool for CPU-bound image work so it never blocks the event loop
+_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Kept as bytes so the data URL is assembled with one bytes join and a
+# single ascii decode instead of an f-string over the ~140 KB payload
+_DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+# libjpeg-turbo codec handles are not thread-safe, so each executor
+# thread lazily gets its own
+_TJ_LOCAL = threading.local()
+
+
+def _get_turbojpeg() -> TurboJPEG:
+    tj = getattr(_TJ_LOCAL, 'tj', None)
+    if tj is None:
+        tj = _TJ_LOCAL.tj = TurboJPEG()
+    return tj
+
+
 class OpenAIVideoAnalysisService:
     """Service for analyzing video frames using OpenAI GPT-4o Vision"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, jpeg_quality: int = 60):
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+        # JPEG quality for outbound frames. Driver-monitoring frames are
+        # low-texture, so quality 60 with 4:2:0 chroma subsampling keeps
+        # the analysis usable while cutting payload size and input tokens
+        self.jpeg_quality = jpeg_quality
         
-        self.client = OpenAI(api_key=self.api_key)
+        # Async client with a pooled HTTP/2 transport - the connection pool
+        # is shared by every consumer through the service singleton, so
+        # frames reuse warm TLS connections instead of handshaking per call
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
         
         # GPT-4o is OpenAI's flagship multimodal model
         # Excellent for vision tasks with fast inference
         self.model = "gpt-4o"
+
+        # Per-thread scratch state (JPEG buffers) for executor workers
+        self._local = threading.local()
         
         self.analysis_prompt = """
         Analyze this image for driver drowsiness detection. Look for:
@@ -51,15 +93,52 @@ class OpenAIVideoAnalysisService:
         - "moderately drowsy": Frequent eye closure, head dropping, clear fatigue
         - "highly drowsy": Eyes mostly/fully closed, significant head drooping, urgent action needed
         """
-    
-    def encode_image(self, image: Image.Image, quality: int = 75) -> str:
-        """Encode PIL image to base64 JPEG string"""
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=quality, optimize=True)
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+        # Static message parts, built once - only the image_url dict
+        # changes between frames
+        self._system_msg = {
+            "role": "system",
+            "content": "You are an expert driver drowsiness detection system. Analyze driver monitoring footage accurately and respond ONLY with valid JSON."
+        }
+        self._text_part = {
+            "type": "text",
+            "text": self.analysis_prompt
+        }
+
+    def _get_jpeg_buffer(self) -> io.BytesIO:
+        """Reusable per-thread JPEG buffer (encode runs on executor threads)"""
+        buffer = getattr(self._local, 'jpeg_buf', None)
+        if buffer is None:
+            buffer = self._local.jpeg_buf = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        return buffer
+
+    def encode_image(self, image: Image.Image, quality: Optional[int] = None) -> bytes:
+        """Encode PIL image to base64 JPEG bytes"""
+        if quality is None:
+            quality = self.jpeg_quality
+        buffer = self._get_jpeg_buffer()
+        # optimize=True ran a second Huffman pass for ~2x the encode time
+        # and only a few percent smaller payloads - not worth it here
+        image.save(
+            buffer,
+            format='JPEG',
+            quality=quality,
+            subsampling=2,  # 4:2:0 chroma subsampling
+            optimize=False,
+            progressive=False
+        )
+        # getbuffer() avoids copying the JPEG bytes before the SIMD encode
+        return pybase64.b64encode(buffer.getbuffer())
     
     def preprocess_image(self, image: Image.Image, max_size: tuple = (1024, 1024)) -> Image.Image:
         """Preprocess image for optimal analysis"""
+        # Halve with the integer box filter until within 2x of the target -
+        # reduce() is much cheaper than running LANCZOS at large scale factors
+        while image.size[0] > 2 * max_size[0] or image.size[1] > 2 * max_size[1]:
+            image = image.reduce(2)
+
         # Resize if too large (GPT-4o has context limits)
         if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
             image.thumbnail(max_size, Image.Resampling.LANCZOS)
@@ -70,58 +149,114 @@ class OpenAIVideoAnalysisService:
         
         return image
     
-    async def analyze_frame(self, frame_data: bytes) -> dict:
-        """Analyze a single video frame using GPT-4o Vision"""
+    def _to_jpeg_bytes(self, frame_data: bytes) -> bytes:
+        """Decode, downscale and re-encode a frame with libjpeg-turbo
+
+        TurboJPEG skips the format sniff and plugin machinery entirely:
+        the input is known to be JPEG, the 1/2 scaling factor runs inside
+        the SIMD IDCT, and the pixels stay in a single numpy buffer. One
+        INTER_AREA resize clamps non-standard sizes to 1024 px before the
+        native re-encode.
+        """
+        tj = _get_turbojpeg()
+        img = tj.decode(frame_data, pixel_format=TJPF_RGB,
+                        scaling_factor=(1, 2))
+
+        height, width = img.shape[:2]
+        if max(height, width) > 1024:
+            scale = 1024 / max(height, width)
+            img = cv2.resize(
+                img,
+                (int(width * scale), int(height * scale)),
+                interpolation=cv2.INTER_AREA
+            )
+
+        return tj.encode(img, quality=self.jpeg_quality,
+                         pixel_format=TJPF_RGB)
+
+    def _prepare_payload(self, frame_data: bytes) -> str:
+        """Decode, preprocess and encode a frame to a data URL (runs in the executor)"""
+        jpeg = self._to_jpeg_bytes(frame_data)
+        return (_DATA_URL_PREFIX + pybase64.b64encode(jpeg)).decode('ascii')
+
+    async def analyze_frame(self, frame_data: bytes, return_raw: bool = False,
+                            on_delta=None):
+        """Analyze a single video frame using GPT-4o Vision
+
+        With return_raw=True, returns (result, raw_json) where raw_json is
+        the model's own JSON text when it parsed cleanly (None otherwise),
+        so callers can splice it into an envelope without re-serializing.
+
+        on_delta, when given, is an async callable invoked with each text
+        chunk as the completion streams in, so callers can surface progress
+        before the full response has arrived.
+        """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(frame_data))
-            
-            # Preprocess image
-            image = self.preprocess_image(image)
-            
-            # Encode to base64
-            base64_image = self.encode_image(image)
-            
+            loop = asyncio.get_running_loop()
+
+            # Decode/resize/encode is CPU-bound - keep it off the event loop
+            image_url = await loop.run_in_executor(
+                _EXECUTOR, self._prepare_payload, frame_data
+            )
+
             # Prepare the request with vision capabilities
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert driver drowsiness detection system. Analyze driver monitoring footage accurately and respond ONLY with valid JSON."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": self.analysis_prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
+            messages = [
+                self._system_msg,
+                {
+                    "role": "user",
+                    "content": [
+                        self._text_part,
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_url
                             }
-                        ]
-                    }
-                ],
-                max_tokens=500,
-                temperature=0.3,  # Lower temperature for consistent results
-                response_format={"type": "json_object"}
-            )
-            
+                        }
+                    ]
+                }
+            ]
+
+            if on_delta is None:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.3,  # Lower temperature for consistent results
+                    response_format={"type": "json_object"}
+                )
+                content = response.choices[0].message.content
+            else:
+                # Stream the completion and forward chunks as they arrive;
+                # the accumulated buffer is parsed once the stream closes
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.3,
+                    response_format={"type": "json_object"},
+                    stream=True
+                )
+                parts = []
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        delta = chunk.choices[0].delta.content
+                        parts.append(delta)
+                        await on_delta(delta)
+                content = ''.join(parts)
+
             # Parse JSON response
-            content = response.choices[0].message.content
-            
+            raw = None
+
             try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
+                result = orjson.loads(content)
+                raw = content
+            except orjson.JSONDecodeError:
                 # Fallback parsing
                 start = content.find('{')
                 end = content.rfind('}') + 1
                 if start != -1 and end != 0:
-                    result = json.loads(content[start:end])
+                    raw = content[start:end]
+                    result = orjson.loads(raw)
                 else:
                     result = {
                         "drowsiness_level": "unknown",
@@ -129,17 +264,18 @@ class OpenAIVideoAnalysisService:
                         "observations": ["Failed to parse analysis"],
                         "recommended_action": "Manual review required"
                     }
-            
-            return result
-            
+
+            return (result, raw) if return_raw else result
+
         except Exception as e:
-            return {
+            result = {
                 "error": str(e),
                 "drowsiness_level": "unknown",
                 "confidence": 0.0,
                 "observations": [f"Analysis failed: {str(e)}"],
                 "recommended_action": "Check API connection and try again"
             }
+            return (result, None) if return_raw else result
     
     async def analyze_frame_sync(self, frame_data: bytes) -> dict:
         """Synchronous wrapper for frame analysis"""
@@ -175,16 +311,10 @@ class OpenAIVideoAnalysisService:
         }
 
 
-# Singleton instance
-_openai_analysis_service: Optional[OpenAIVideoAnalysisService] = None
-
-
+@functools.cache
 def get_openai_video_analysis_service() -> OpenAIVideoAnalysisService:
     """Get or create the OpenAI video analysis service singleton"""
-    global _openai_analysis_service
-    if _openai_analysis_service is None:
-        _openai_analysis_service = OpenAIVideoAnalysisService()
-    return _openai_analysis_service
+    return OpenAIVideoAnalysisService()
 
 
 async def process_frames_with_openai(frames: list) -> list:
@@ -112,6 +112,11 @@ class VideoAnalysisService {
   
   void _handleMessage(dynamic message) {
     try {
+      // The server sends its JSON envelopes as binary WebSocket frames
+      // (UTF-8 bytes); decode them before the normal JSON handling
+      if (message is List<int>) {
+        message = utf8.decode(message);
+      }
       if (message is String) {
         final data = jsonDecode(message);
         final type = data['type'] ?? 'unknown';